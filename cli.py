@@ -2,8 +2,15 @@ import argparse
 import asyncio
 import os
 
-from codypy.client_info import AgentSpecs
-from codypy.cody_py import CodyAgent, CodyServer
+from codypy.agent import CodyAgent
+from codypy.client_info import MODELS_BY_ID, AgentSpecs
+from codypy.server import CodyServer
+
+# uvloop is an optional, faster event loop, the default one works as well
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 
 async def async_main():
@@ -52,6 +59,13 @@ async def async_main():
         default=False,
         help="Show the inferred context files from the message if any. Default=True",
     )
+    parser.add_argument(
+        "--model",
+        type=str,
+        choices=list(MODELS_BY_ID),
+        default="anthropic/claude-3-sonnet-20240229",
+        help="The chat model to use. Default=anthropic/claude-3-sonnet-20240229",
+    )
 
     args = parser.parse_args()
     await chat(args)
@@ -71,14 +85,16 @@ async def chat(args):
             "customConfiguration": {},
         },
     )
-    cody_agent: CodyAgent = await cody_server.initialize_agent(agent_specs=agent_specs)
+    cody_agent: CodyAgent = CodyAgent(cody_server=cody_server, agent_specs=agent_specs)
+    await cody_agent.initialize_agent()
 
-    await cody_agent.new_chat()
+    # Creates the chat and sets the model in as few round-trips as possible
+    await cody_agent.bootstrap(model=args.model)
 
     response = await cody_agent.chat(
         message=args.message,
-        enhanced_context=args.ec,
-        show_context_files=args.sc,
+        enhanced_context=args.enhanced_context,
+        show_context_files=args.show_context,
     )
     if response == "":
         return
@@ -89,7 +105,10 @@ async def chat(args):
 
 
 def main():
-    asyncio.run(async_main())
+    if uvloop is not None:
+        uvloop.run(async_main())
+    else:
+        asyncio.run(async_main())
 
 
 if __name__ == "__main__":
@@ -1,37 +1,45 @@
-from .agent import CodyAgent
-from .client_info import (
-    AgentSpecs,
-    ClientCapabilities,
-    ExtensionConfiguration,
-    Models,
-    ModelSpec,
-)
-from .config import (
-    BLACK,
-    BLUE,
-    CYAN,
-    GREEN,
-    MAGENTA,
-    RED,
-    RESET,
-    WHITE,
-    YELLOW,
-    Configs,
-    get_configs,
-)
-from .context import append_paths
-from .server import CodyServer
-from .server_info import AuthStatus, CodyAgentInfo, CodyLLMSiteConfiguration
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .agent import CodyAgent
+    from .client_info import (
+        MODELS_BY_ID,
+        AgentSpecs,
+        ClientCapabilities,
+        ExtensionConfiguration,
+        Models,
+        ModelSpec,
+    )
+    from .config import (
+        BLACK,
+        BLUE,
+        CYAN,
+        GREEN,
+        MAGENTA,
+        RED,
+        RESET,
+        WHITE,
+        YELLOW,
+        Configs,
+        get_configs,
+    )
+    from .context import append_paths
+    from .pool import CodyServerPool
+    from .server import CodyServer
+    from .server_info import AuthStatus, CodyAgentInfo, CodyLLMSiteConfiguration
 
 __all__ = [
     "CodyAgent",
     "CodyServer",
+    "CodyServerPool",
     "Configs",
     "get_configs",
     "ClientCapabilities",
     "AgentSpecs",
     "Models",
     "ModelSpec",
+    "MODELS_BY_ID",
     "CodyAgentInfo",
     "AuthStatus",
     "CodyLLMSiteConfiguration",
@@ -47,3 +55,46 @@ __all__ = [
     "WHITE",
     "append_paths",
 ]
+
+# The submodule each export is defined in. They are imported on first access,
+# so `import codypy` doesn't load pydantic and the server code up front.
+_EXPORTS = {
+    "CodyAgent": "agent",
+    "CodyServer": "server",
+    "CodyServerPool": "pool",
+    "Configs": "config",
+    "get_configs": "config",
+    "ClientCapabilities": "client_info",
+    "AgentSpecs": "client_info",
+    "Models": "client_info",
+    "ModelSpec": "client_info",
+    "MODELS_BY_ID": "client_info",
+    "CodyAgentInfo": "server_info",
+    "AuthStatus": "server_info",
+    "CodyLLMSiteConfiguration": "server_info",
+    "ExtensionConfiguration": "client_info",
+    "RESET": "config",
+    "BLACK": "config",
+    "RED": "config",
+    "GREEN": "config",
+    "YELLOW": "config",
+    "BLUE": "config",
+    "MAGENTA": "config",
+    "CYAN": "config",
+    "WHITE": "config",
+    "append_paths": "context",
+}
+
+
+def __getattr__(name: str):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(f".{module}", __name__), name)
+    # Cache it, so later lookups don't come through here again
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -1,26 +1,68 @@
+import asyncio
 import logging
-from typing import Any
+import sys
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, AsyncIterator
 
-from codypy.client_info import AgentSpecs, Models
+from codypy.client_info import AgentSpecs, Models, ModelSpec
 from codypy.exceptions import AgentAuthenticationError
-from codypy.messaging import _show_last_message, request_response
-from codypy.server import CodyServer
+from codypy.messaging import _show_last_message
 from codypy.server_info import CodyAgentInfo
 
+if TYPE_CHECKING:
+    from codypy.server import CodyServer
+
 logger = logging.getLogger(__name__)
 
+# JSON-RPC methods and webview commands sent on every session, interned once
+# so they are shared and hash-cached wherever they are used as dict keys.
+_RPC_INITIALIZE = sys.intern("initialize")
+_RPC_NEW_CHAT = sys.intern("chat/new")
+_RPC_MODELS = sys.intern("chat/models")
+_RPC_RECEIVE = sys.intern("webview/receiveMessage")
+_RPC_SUBMIT = sys.intern("chat/submitMessage")
+_RPC_GET_REPO_IDS = sys.intern("graphql/getRepoIds")
+_RPC_POST_MESSAGE = sys.intern("webview/postMessage")
+_CMD_SUBMIT = sys.intern("submit")
+_CMD_CHAT_MODEL = sys.intern("chatModel")
+_CMD_CHOOSE_REPO = sys.intern("context/choose-remote-search-repo")
+
+# Messages that end the chat instead of being sent
+_QUIT_COMMANDS = frozenset(("/quit", "/bye", "/exit"))
+
+# Number of resolved repository contexts remembered per agent
+_REPO_CONTEXT_CACHE_SIZE = 32
+
 
 class CodyAgent:
+    __slots__ = (
+        "_cody_server",
+        "chat_id",
+        "repos",
+        "_repos_missing",
+        "current_repo_context",
+        "_repo_context_key",
+        "agent_specs",
+        "_repo_context_cache",
+        "_model_key",
+    )
+
     def __init__(
         self,
-        cody_server: CodyServer,
+        cody_server: "CodyServer",
         agent_specs: AgentSpecs,
     ) -> None:
         self._cody_server = cody_server
         self.chat_id: str | None = None
-        self.repos: dict = {}
+        self.repos: dict[str, dict] = {}
+        self._repos_missing: set[str] = set()
         self.current_repo_context: list[str] = []
+        self._repo_context_key: tuple[str | None, frozenset[str]] | None = None
         self.agent_specs = agent_specs
+        self._repo_context_cache: OrderedDict[tuple[str, ...], list[dict]] = (
+            OrderedDict()
+        )
+        self._model_key: tuple[str | None, str] | None = None
 
     async def initialize_agent(self) -> None:
         """
@@ -36,7 +78,15 @@ class CodyAgent:
 
         async def _handle_response(response: Any) -> None:
             # TODO: Consider attaching CodyAgentInfo to CodyAgent
-            cody_agent_info: CodyAgentInfo = CodyAgentInfo.model_validate(response)
+            # The agent is a trusted peer, so skip validating a well-formed
+            # response. Nested objects such as authStatus stay plain dicts.
+            if isinstance(response, dict) and "name" in response:
+                cody_agent_info: CodyAgentInfo = CodyAgentInfo.model_construct(
+                    **response
+                )
+            else:
+                # Raises a ValidationError describing what is missing
+                cody_agent_info = CodyAgentInfo.model_validate(response)
             # TODO: Prevent printing access token. Pydantic.SecretStr did not work
             logger.debug("CodyAgent initialized with specs: %s", self.agent_specs)
             logger.debug("CodyAgent Info: %s", cody_agent_info)
@@ -46,11 +96,9 @@ class CodyAgent:
                 raise AgentAuthenticationError("CodyAgent is not authenticated")
             logger.info("CodyAgent initialized successfully")
 
-        response = await request_response(
-            "initialize",
-            self.agent_specs.model_dump(),
-            self._cody_server._reader,
-            self._cody_server._writer,
+        response = await self._cody_server.request_response(
+            _RPC_INITIALIZE,
+            self.agent_specs.json_bytes,
         )
 
         await _handle_response(response)
@@ -58,46 +106,87 @@ class CodyAgent:
     async def new_chat(self):
         """Initiates a new chat session with the Cody agent server."""
 
-        response = await request_response(
-            "chat/new",
+        response = await self._cody_server.request_response(
+            _RPC_NEW_CHAT,
             None,
-            self._cody_server._reader,
-            self._cody_server._writer,
         )
 
         logger.info("New chat session %s created", response)
         self.chat_id = response
 
+    async def bootstrap(
+        self,
+        model: Models | ModelSpec | str = Models.Claude3Sonnet,
+        repos: list[str] | None = None,
+    ) -> Any:
+        """
+        Prepares a new chat session in as few round-trips as possible: the
+        available chat models are retrieved and the new chat is created in a
+        single batch, then the model and the context repositories are set
+        concurrently.
+
+        Args:
+            model (Models | ModelSpec | str): The model to be used for the chat session.
+                                              Defaults to Models.Claude3Sonnet.
+            repos (list[str] | None): Name of the repositories which should be used
+                                      for the chat context, if any.
+
+        Returns:
+            Any: The result of the "chat/models" request.
+        """
+        models, self.chat_id = await self._cody_server.batched_request_response(
+            [(_RPC_MODELS, {"modelUsage": "chat"}), (_RPC_NEW_CHAT, None)]
+        )
+        logger.info("New chat session %s created", self.chat_id)
+
+        setup = [self.set_model(model)]
+        if repos:
+            setup.append(self.set_context_repo(repos))
+        await asyncio.gather(*setup)
+        return models
+
     async def _lookup_repo_ids(self, repos: list[str]) -> list[dict]:
         """Lookup repository objects via their names
 
-        Results are cached in self.repos dictionary to avoid extra lookups
-        if context is changed.
+        Results are cached in self.repos dictionary, and names that weren't
+        found in self._repos_missing, to avoid extra lookups if context is
+        changed. The resolved list is also kept for the most recently used
+        repository lists, so switching back and forth between contexts
+        reuses it.
 
         Args:
             context_repos (list of strings): Name of the repositories which should
                                              be used for the chat context.
         """
 
-        if repos_to_lookup := [x for x in repos if x not in self.repos]:
+        # Keyed in the caller's order, as the result follows that order
+        key = tuple(repos)
+        if (repo_objects := self._repo_context_cache.get(key)) is not None:
+            self._repo_context_cache.move_to_end(key)
+            return repo_objects
+
+        if repos_to_lookup := [
+            x for x in repos if x not in self.repos and x not in self._repos_missing
+        ]:
             # Example input: github.com/jsmith/awesomeapp
             # Example output: {"repos":[{"name":"github.com/jsmith/awesomeapp","id":"UmVwb3NpdG9yeToxMjM0"}]}
-            response = await request_response(
-                "graphql/getRepoIds",
+            response = await self._cody_server.request_response(
+                _RPC_GET_REPO_IDS,
                 {"names": repos_to_lookup, "first": len(repos_to_lookup)},
-                self._cody_server._reader,
-                self._cody_server._writer,
             )
 
             for repo in response["repos"]:
                 self.repos[repo["name"]] = repo
-            # Whatever we didn't find, add it to a cache with a None
-            # to avoid further lookups.
-            for repo in repos:
-                if repo not in self.repos:
-                    self.repos[repo] = None
+            # Remember whatever we didn't find to avoid further lookups
+            self._repos_missing.update(
+                x for x in repos_to_lookup if x not in self.repos
+            )
 
-        return [self.repos[x] for x in repos if self.repos[x]]
+        repo_objects = [self.repos[x] for x in repos if x in self.repos]
+        self._repo_context_cache[key] = repo_objects
+        if len(self._repo_context_cache) > _REPO_CONTEXT_CACHE_SIZE:
+            self._repo_context_cache.popitem(last=False)
+        return repo_objects
 
     async def set_context_repo(self, repos: list[str]) -> None:
         """Set repositories to use as context
@@ -105,29 +194,35 @@ class CodyAgent:
         Args:
             context_repos (list of strings): Name of the repositories which should
                                              be used for the chat context.
+
+        Raises:
+            AgentRequestError: If the agent failed to set the context or didn't answer in time.
         """
 
-        if self.current_repo_context == repos:
+        # The context belongs to the chat, a new chat needs it set again
+        key = (self.chat_id, frozenset(repos))
+        if key == self._repo_context_key:
             return
 
-        self.current_repo_context = repos
-
         repo_objects = await self._lookup_repo_ids(repos=repos)
 
         # Configure the selected repositories for the chat context
         command = {
             "id": self.chat_id,
             "message": {
-                "command": "context/choose-remote-search-repo",
+                "command": _CMD_CHOOSE_REPO,
                 "explicitRepos": repo_objects,
             },
         }
-        await request_response(
-            "webview/receiveMessage",
+        # Raises if the agent didn't apply the context, so it is set again
+        # on the next call instead of being skipped
+        await self._cody_server.request_response(
+            _RPC_RECEIVE,
             command,
-            self._cody_server._reader,
-            self._cody_server._writer,
+            raise_on_error=True,
         )
+        self.current_repo_context = repos
+        self._repo_context_key = key
 
     async def get_models(self, model_type: str) -> Any:
         """
@@ -140,36 +235,85 @@ class CodyAgent:
             Any: The result of the "chat/models" request.
         """
 
-        model = {"modelUsage": f"{model_type}"}
-        return await request_response(
-            "chat/models",
+        model = {"modelUsage": model_type}
+        return await self._cody_server.request_response(
+            _RPC_MODELS,
             model,
-            self._cody_server._reader,
-            self._cody_server._writer,
         )
 
-    async def set_model(self, model: Models = Models.Claude3Sonnet) -> Any:
+    async def set_model(
+        self, model: Models | ModelSpec | str = Models.Claude3Sonnet
+    ) -> Any:
         """
         Sets the model to be used for the chat session.
 
         Args:
-            model (Models): The model to be used for the chat session. Defaults to Models.Claude3Sonnet.
+            model (Models | ModelSpec | str): The model to be used for the chat session, either
+                                              a Models member, a ModelSpec (e.g. from MODELS_BY_ID)
+                                              or a model id. Defaults to Models.Claude3Sonnet.
 
         Returns:
-            Any: The result of the "webview/receiveMessage" request.
+            Any: The result of the "webview/receiveMessage" request, or None if
+                 the chat already uses the model.
+
+        Raises:
+            AgentRequestError: If the agent failed to set the model or didn't answer in time.
         """
 
+        if isinstance(model, Models):
+            model_id = model.value.model_id
+        elif isinstance(model, ModelSpec):
+            model_id = model.model_id
+        else:
+            model_id = model
+
+        # The model belongs to the chat, a new chat needs it set again
+        key = (self.chat_id, model_id)
+        if key == self._model_key:
+            return None
+
         command = {
-            "id": f"{self.chat_id}",
-            "message": {"command": "chatModel", "model": f"{model.value.model_id}"},
+            "id": self.chat_id,
+            "message": {"command": _CMD_CHAT_MODEL, "model": model_id},
         }
 
-        return await request_response(
-            "webview/receiveMessage",
+        # Raises if the agent didn't switch the model, so it is set again on
+        # the next call instead of being skipped
+        response = await self._cody_server.request_response(
+            _RPC_RECEIVE,
             command,
-            self._cody_server._reader,
-            self._cody_server._writer,
+            raise_on_error=True,
         )
+        self._model_key = key
+        return response
+
+    def _chat_message_request(
+        self,
+        message: str,
+        enhanced_context: bool,
+        context_files: list | None,
+    ) -> dict[str, Any]:
+        """
+        Builds the params of the "chat/submitMessage" request for a user message.
+
+        Args:
+            message (str): The message to be sent to the Cody server.
+            enhanced_context (bool): Whether to include enhanced context in the chat message request.
+            context_files (list | None): The context files to send with the message, if any.
+
+        Returns:
+            dict[str, Any]: The params of the request.
+        """
+        return {
+            "id": self.chat_id,
+            "message": {
+                "command": _CMD_SUBMIT,
+                "text": message,
+                "submitType": "user",
+                "addEnhancedContext": enhanced_context,
+                "contextFiles": context_files if context_files is not None else [],
+            },
+        }
 
     async def chat(
         self,
@@ -188,30 +332,18 @@ class CodyAgent:
         Returns:
             str: The response from the Cody server, formatted as a string with the speaker and response.
         """
-        if context_files is None:
-            context_files = []
-        if message in ["/quit", "/bye", "/exit"]:
+        if message in _QUIT_COMMANDS:
             return "", []
+        chat_message_request = self._chat_message_request(
+            message, enhanced_context, context_files
+        )
 
-        chat_message_request = {
-            "id": f"{self.chat_id}",
-            "message": {
-                "command": "submit",
-                "text": message,
-                "submitType": "user",
-                "addEnhancedContext": enhanced_context,
-                "contextFiles": context_files,
-            },
-        }
-
-        result = await request_response(
-            "chat/submitMessage",
+        result = await self._cody_server.request_response(
+            _RPC_SUBMIT,
             chat_message_request,
-            self._cody_server._reader,
-            self._cody_server._writer,
         )
 
-        (speaker, response, context_files_response) = await _show_last_message(
+        speaker, response, context_files_response = _show_last_message(
             result,
             show_context_files,
         )
@@ -219,3 +351,71 @@ class CodyAgent:
             logger.error("Failed to submit chat message: %s", result)
             return None
         return (response, context_files_response)
+
+    async def chat_stream(
+        self,
+        message,
+        enhanced_context: bool = True,
+        context_files=None,
+    ) -> AsyncIterator[tuple[str, str]]:
+        """
+        Sends a chat message to the Cody server and yields the response while
+        it is being generated, so callers see the first words without waiting
+        for the complete response.
+
+        Args:
+            message (str): The message to be sent to the Cody server.
+            enhanced_context (bool, optional): Whether to include enhanced context in the chat message request. Defaults to True.
+            context_files (list, optional): The context files to send with the message, e.g. from `append_paths`. Defaults to None.
+
+        Yields:
+            tuple[str, str]: The speaker and the text added to the response since the previous item.
+        """
+        if message in _QUIT_COMMANDS:
+            return
+        chat_message_request = self._chat_message_request(
+            message, enhanced_context, context_files
+        )
+
+        streamed = ""
+        with self._cody_server.notifications(_RPC_POST_MESSAGE) as updates:
+            submit = asyncio.ensure_future(
+                self._cody_server.request_response(_RPC_SUBMIT, chat_message_request)
+            )
+            try:
+                # The agent posts the whole transcript so far with every update,
+                # only the text added to the reply since the last one is yielded.
+                while True:
+                    update = asyncio.ensure_future(updates.get())
+                    await asyncio.wait(
+                        (submit, update), return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if not update.done():
+                        update.cancel()
+                        break
+                    params = update.result()
+                    if params.get("id") != self.chat_id:
+                        continue
+                    speaker, text, _ = _show_last_message(params.get("message"), False)
+                    if speaker == "assistant" and text.startswith(streamed):
+                        if delta := text[len(streamed) :]:
+                            yield speaker, delta
+                            streamed = text
+                result = await submit
+            finally:
+                submit.cancel()
+
+        speaker, text, _ = _show_last_message(result, False)
+        if speaker == "" or text == "":
+            logger.error("Failed to submit chat message: %s", result)
+            return
+        if not text.startswith(streamed):
+            # The agent rewrote text that was already yielded, it can't be taken back
+            logger.warning(
+                "Final response doesn't continue the streamed text, "
+                "dropping the rest: %r",
+                text,
+            )
+            return
+        if delta := text[len(streamed) :]:
+            yield speaker, delta
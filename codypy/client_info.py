@@ -1,6 +1,7 @@
 from dataclasses import dataclass
 from enum import Enum
-from typing import Dict, Literal
+from types import MappingProxyType
+from typing import Dict, Literal, Mapping
 
 from pydantic import BaseModel
 
@@ -71,8 +72,23 @@ class AgentSpecs(BaseModel):
         self.version = version
         self.workspaceRootPath = workspaceRootUri
 
+    @property
+    def json_bytes(self) -> bytes:
+        """
+        The JSON encoded specs, ready to be spliced into the "initialize"
+        request. Encoded on every access, so changes made to the specs (or to
+        a copy of them) are always picked up.
 
-@dataclass
+        Unset optional fields are left out rather than sent as null, the
+        agent treats both the same.
+
+        Returns:
+            bytes: The JSON encoded specs.
+        """
+        return self.model_dump_json(exclude_none=True).encode()
+
+
+@dataclass(slots=True, frozen=True)
 class ModelSpec:
     model_name: str = ""
     model_id: str = ""
@@ -121,3 +137,10 @@ class Models(Enum):
         model_name="Mixtral 8x22b Preview",
         model_id="fireworks/accounts/fireworks/models/mixtral-8x22b-instruct-preview",
     )
+
+
+# Precomputed lookup to resolve a model by its id (e.g. from the CLI)
+# without walking the Models enum. Read-only, as it is shared by all agents.
+MODELS_BY_ID: Mapping[str, ModelSpec] = MappingProxyType(
+    {m.value.model_id: m.value for m in Models}
+)
@@ -13,19 +13,29 @@ CYAN = "\033[36m"
 WHITE = "\033[37m"
 
 
-@dataclass
+@dataclass(slots=True)
 class Configs:
     BINARY_PATH: str = ""
-    SERVER_ADDRESS = ("localhost", 3113)
+    SERVER_ADDRESS: tuple[str, int] = ("localhost", 3113)
     WORKSPACE: str = ""
     USE_TCP: bool = False
     IS_DEBUGGING: bool = False
+    # Buffer limit in bytes of the streams reading from the agent. A whole
+    # JSON-RPC message is buffered before it is parsed, chat transcripts
+    # can be large.
+    READ_BUFFER_LIMIT: int = 1 << 20
+    # Disable Nagle's algorithm on the TCP connection, so small requests are
+    # sent without waiting for the previous one to be acknowledged.
+    TCP_NODELAY: bool = True
+    # Don't keep written requests in asyncio's write buffer, writers wait
+    # in drain() until the transport has handed everything to the OS.
+    ZERO_WRITE_BUFFER: bool = False
 
 
 configs = Configs()
 
 
-async def get_configs() -> Configs:
+def get_configs() -> Configs:
     """
     Returns the global configuration object.
 
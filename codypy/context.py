@@ -4,41 +4,70 @@ from dataclasses import dataclass
 
 logger = logging.getLogger(__name__)
 
+# Listing a directory reads all of its entries, which only pays off over a
+# stat per path when a good number of the paths are in that directory
+_SCANDIR_MIN_PATHS = 8
 
-@dataclass
+
+@dataclass(slots=True)
 class Uri:
     fsPath: str = ""
     path: str = ""
 
 
-@dataclass
+@dataclass(slots=True)
 class Context:
     type: str = "file"
     uri: Uri | None = None
 
 
-context_file_paths: list[Context] = []
-
-
 def append_paths(*paths: str) -> list[Context]:
     """
-    Appends the provided file paths to the `context_file_paths` list, creating a `Context` object for each path.
+    Creates a `Context` object for each of the provided file paths.
+
+    Paths that don't exist are still included, but a warning is logged.
+    When many paths share a directory, the directory is listed once
+    instead of checking every path on its own.
 
     Args:
-        *paths (str): One or more file paths to append to the `context_file_paths` list.
+        *paths (str): One or more file paths to use as chat context.
 
     Returns:
-        list[Context]: The updated `context_file_paths` list.
+        list[Context]: The context objects, in the order of `paths`.
     """
+    by_directory: dict[str, list[str]] = {}
     for path in paths:
-        if not os.path.exists(path):
-            logger.warning("The path %s does not exist", path)
+        by_directory.setdefault(os.path.dirname(path), []).append(path)
+
+    missing: set[str] = set()
+    for directory, dir_paths in by_directory.items():
+        if len(dir_paths) < _SCANDIR_MIN_PATHS or not all(
+            map(os.path.basename, dir_paths)
+        ):
+            missing.update(path for path in dir_paths if not os.path.exists(path))
+            continue
+        wanted = set(map(os.path.basename, dir_paths))
+        found: set[str] = set()
+        try:
+            with os.scandir(directory or os.curdir) as it:
+                for entry in it:
+                    # A listed symlink may be broken, so it is checked below
+                    if entry.name in wanted and not entry.is_symlink():
+                        found.add(entry.name)
+        except OSError:
+            pass
+        # A name missing from the listing may still exist, e.g. ".." or a
+        # differently cased name on a case-insensitive filesystem
+        missing.update(
+            path
+            for path in dir_paths
+            if os.path.basename(path) not in found and not os.path.exists(path)
+        )
 
-        uri = Uri()
-        uri.fsPath = path
-        uri.path = path
-        context = Context()
-        context.uri = uri
-        context_file_paths.append(context)
+    context_file_paths: list[Context] = []
+    for path in paths:
+        if path in missing:
+            logger.warning("The path %s does not exist", path)
+        context_file_paths.append(Context(uri=Uri(fsPath=path, path=path)))
 
     return context_file_paths
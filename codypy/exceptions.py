@@ -34,3 +34,11 @@ class ServerTCPConnectionError(CodyPyError):
     def __init__(self, message="Could not connect to server via TCP"):
         self.message = message
         super().__init__(self.message)
+
+
+class AgentRequestError(CodyPyError):
+    """Raised when the Cody agent answers a request with an error or not in time."""
+
+    def __init__(self, message="The Cody agent request failed"):
+        self.message = message
+        super().__init__(self.message)
@@ -1,193 +1,283 @@
 import asyncio
+import itertools
 import logging
-from json import JSONDecodeError
-from typing import Any, AsyncGenerator, Dict, Tuple
+from typing import Any, AsyncGenerator, Dict, Set, Tuple
 
 import pydantic_core as pd
 
-from codypy.config import Configs
+from codypy.config import Configs, configs
+from codypy.exceptions import AgentRequestError
 
-logger = logging.getLogger(__name__)
-stream_logger = logging.getLogger(f"{__name__}.stream")
+# orjson is an optional speedup for encoding and decoding the JSON-RPC
+# messages, fall back to pydantic_core otherwise. Both return bytes when
+# encoding, so the result can be written to the stream without a copy.
+try:
+    import orjson
 
-MESSAGE_ID = 1
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    _dumps = pd.to_json
 
+    def _loads(data: bytes | memoryview) -> Any:
+        # Unlike orjson, pydantic_core does not accept memoryviews
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return pd.from_json(data)
 
-async def _send_jsonrpc_request(
-    writer: asyncio.StreamWriter, method: str, params: Dict[str, Any] | None
-) -> None:
-    """
-    Sends a JSON-RPC request to the server.
 
-    Args:
-        writer: The asyncio StreamWriter to use for sending the request.
-        method: The JSON-RPC method to call.
-        params: The parameters to pass to the JSON-RPC method,
-                or None if no parameters are required.
+logger = logging.getLogger(__name__)
+stream_logger = logging.getLogger(f"{__name__}.stream")
 
-    Raises:
-        None
-    """
-    global MESSAGE_ID
-    message: Dict[str, Any] = {
-        "jsonrpc": "2.0",
-        "id": MESSAGE_ID,
-        "method": method,
-        "params": params,
-    }
-
-    # Convert the message to JSON string
-    json_message: bytes = pd.to_json(message)
-    content_length: int = len(json_message)
-    content_message: bytes = (
-        f"Content-Length: {content_length}\r\n\r\n".encode() + json_message
-    )
+# Seconds the server may stay silent after a request was sent before the
+# request resolves to None
+_READ_TIMEOUT = 5.0
 
-    # Send the JSON-RPC message to the server
-    writer.write(content_message)
-    await writer.drain()
-    MESSAGE_ID += 1
+# Allocates the id for the next JSON-RPC request
+_next_message_id = itertools.count(1).__next__
+
+# Request envelope per method name, with the id and params left to fill in
+_ENVELOPES: Dict[str, bytes] = {}
 
 
-async def _receive_jsonrpc_messages(reader: asyncio.StreamReader) -> str:
+def _encode_jsonrpc_request(
+    method: str, params: Dict[str, Any] | bytes | None, message_id: int
+) -> bytes:
     """
-    Reads a JSON-RPC message from the provided `asyncio.StreamReader`.
+    Encodes a JSON-RPC request into a Content-Length framed message.
 
     Args:
-        reader: The `asyncio.StreamReader` to read the message from.
+        method: The JSON-RPC method to call.
+        params: The parameters to pass to the JSON-RPC method, already JSON
+                encoded bytes, or None if no parameters are required.
+        message_id: The id to send the request with.
 
     Returns:
-        The JSON-RPC message as a string.
-
-    Raises:
-        asyncio.TimeoutError: If the message cannot be read within the 5 second timeout.
+        bytes: The framed message, ready to be written to the server.
     """
-    headers: bytes = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5.0)
-    content_length: int = int(
-        headers.decode("utf-8").split("Content-Length:")[1].strip()
-    )
-
-    json_data: bytes = await asyncio.wait_for(
-        reader.readexactly(content_length), timeout=5.0
-    )
-    return json_data.decode("utf-8")
+    # Only the params need the JSON encoder, the envelope around them is
+    # fixed for a method. Pre-encoded params (e.g. AgentSpecs.json_bytes) are
+    # spliced in as is instead of being serialized again.
+    if not isinstance(params, bytes):
+        params = _dumps(params)
+    envelope = _ENVELOPES.get(method)
+    if envelope is None:
+        # A "%" in the method name must not be taken for a format directive
+        method_json = _dumps(method).replace(b"%", b"%%")
+        envelope = _ENVELOPES[method] = (
+            b'{"jsonrpc":"2.0","id":%%d,"method":%b,"params":%%b}' % method_json
+        )
+    json_message = envelope % (message_id, params)
+    # Header and body go out as one buffer, so every request is a single write
+    return b"Content-Length: %d\r\n\r\n%b" % (len(json_message), json_message)
 
 
-async def _handle_server_respones(
-    reader: asyncio.StreamReader,
-) -> AsyncGenerator[Dict[str, Any], Any]:
+def _needs_drain(writer: asyncio.StreamWriter) -> bool:
     """
-    Asynchronously handles server responses by reading JSON-RPC messages
-    from the provided `asyncio.StreamReader`.
-
-    This function yields each JSON-RPC response as a dictionary, until a timeout occurs.
+    Checks whether the writer's buffer is over its high-water mark or the
+    connection is closing. Otherwise `drain()` returns right away, so awaiting
+    it only costs a coroutine.
 
     Args:
-        reader: The `asyncio.StreamReader` to read the JSON-RPC messages from.
-
-    Yields:
-        A dictionary representing the JSON-RPC response.
+        writer: The asyncio StreamWriter that was written to.
 
-    Raises:
-        asyncio.TimeoutError: If a JSON-RPC message cannot be read within the 5 second timeout.
+    Returns:
+        bool: True if `drain()` has to be awaited, False otherwise.
     """
-    try:
-        while True:
-            response: str = await _receive_jsonrpc_messages(reader)
-            yield pd.from_json(response)
-    except asyncio.TimeoutError:
-        yield pd.from_json("{}")
+    transport = writer.transport
+    # drain() raises on a lost connection, which write() alone doesn't
+    return (
+        transport.is_closing()
+        or transport.get_write_buffer_size() > transport.get_write_buffer_limits()[1]
+    )
 
 
-async def _has_method(json_response: Dict[str, Any]) -> bool:
+async def _send_jsonrpc_request(
+    writer: asyncio.StreamWriter,
+    method: str,
+    params: Dict[str, Any] | bytes | None,
+    message_id: int | None = None,
+) -> int:
     """
-    Checks if the provided JSON response contains a "method" key.
+    Sends a JSON-RPC request to the server.
 
     Args:
-        json_response (Dict[str, Any]): The JSON response to check.
+        writer: The asyncio StreamWriter to use for sending the request.
+        method: The JSON-RPC method to call.
+        params: The parameters to pass to the JSON-RPC method, already JSON
+                encoded bytes, or None if no parameters are required.
+        message_id: The id to send the request with, or None to allocate a new one.
 
     Returns:
-        bool: True if the JSON response contains a "method" key, False otherwise.
+        int: The id the request was sent with.
     """
-    return "method" in json_response
+    if message_id is None:
+        message_id = _next_message_id()
 
+    # Send the JSON-RPC message to the server
+    writer.write(_encode_jsonrpc_request(method, params, message_id))
+    if _needs_drain(writer):
+        await writer.drain()
+    return message_id
 
-async def _has_result(json_response: Dict[str, Any]) -> bool:
-    """
-    Checks if the provided JSON response contains a "result" key.
-
-    Args:
-        json_response (Dict[str, Any]): The JSON response to check.
 
-    Returns:
-        bool: True if the JSON response contains a "result" key, False otherwise.
+class _BatchingDispatcher:
     """
-    return "result" in json_response
+    Coalesces the JSON-RPC requests sent within a short window of each other
+    into a single write, so a burst of concurrent requests costs one write
+    and one drain instead of one per request.
 
+    The agent's JSON-RPC implementation doesn't accept JSON-RPC batch arrays,
+    so the framed requests are written back to back instead.
+    """
 
-async def _extraxt_result(json_response: Dict[str, Any]) -> Dict[str, Any] | None:
+    def __init__(
+        self,
+        writer: asyncio.StreamWriter,
+        batch_window: float,
+        max_batch: int,
+    ) -> None:
+        self._writer = writer
+        self._batch_window = batch_window
+        self._max_batch = max_batch
+        self._frames: list[bytes] = []
+        self._flushed: asyncio.Future | None = None
+        self._timer: asyncio.TimerHandle | None = None
+        self._writes: Set[asyncio.Task] = set()
+
+    async def send(self, frame: bytes) -> None:
+        """
+        Queues a framed request and waits until the batch it belongs to has
+        been written.
+
+        Args:
+            frame: The framed request, as returned by `_encode_jsonrpc_request`.
+        """
+        if self._flushed is None:
+            loop = asyncio.get_running_loop()
+            self._flushed = loop.create_future()
+            self._timer = loop.call_later(self._batch_window, self.flush)
+        flushed = self._flushed
+        self._frames.append(frame)
+        if len(self._frames) >= self._max_batch:
+            self.flush()
+        # A cancelled request must not cancel the write of the whole batch
+        await asyncio.shield(flushed)
+
+    def flush(self) -> None:
+        """
+        Writes the queued requests without waiting for the window to end.
+        The requests are written before this returns, only the drain is left
+        to a task.
+        """
+        if self._flushed is None:
+            return
+        self._timer.cancel()
+        frames, flushed = self._frames, self._flushed
+        self._frames, self._flushed, self._timer = [], None, None
+        try:
+            self._writer.writelines(frames)
+        except Exception as exc:  # pylint: disable=broad-except
+            flushed.set_exception(exc)
+            return
+        task = asyncio.ensure_future(self._drain(flushed))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _drain(self, flushed: asyncio.Future) -> None:
+        try:
+            if _needs_drain(self._writer):
+                await self._writer.drain()
+        except Exception as exc:  # pylint: disable=broad-except
+            flushed.set_exception(exc)
+        else:
+            flushed.set_result(None)
+
+
+def _parse_content_length(data: bytes | bytearray, start: int, end: int) -> int:
     """
-    Attempts to extract the "result" key from the provided JSON response dictionary.
+    Reads the Content-Length of a JSON-RPC message from its header.
 
     Args:
-        json_response (Dict[str, Any]): The JSON response dictionary to extract the "result" from.
+        data: The buffer holding the header.
+        start: The offset of the header in `data`.
+        end: The offset of the blank line ending the header in `data`.
 
     Returns:
-        Dict[str, Any] | None: The value of the "result" key if it exists, otherwise None.
-    """
-    try:
-        return json_response["result"]
-    except JSONDecodeError as _:
-        return None
-
+        int: The length of the message body in bytes.
 
-async def _extraxt_method(json_response) -> Dict[str, Any] | None:
+    Raises:
+        ValueError: If the header has no valid Content-Length.
     """
-    Attempts to extract the "method" key from the provided JSON response dictionary.
+    field = data.find(b"Content-Length:", start, end)
+    if field < 0:
+        raise ValueError(
+            f"JSON-RPC message without Content-Length: {data[start:end]!r}"
+        )
+    field += len(b"Content-Length:")
+    line_end = data.find(b"\r\n", field, end)
+    value = data[field : line_end if line_end >= 0 else end].strip()
+    # int() would also accept signs, underscores and surrounding whitespace
+    if not value.isdigit():
+        raise ValueError(f"Invalid Content-Length: {value!r}")
+    return int(value)
 
-    Args:
-        json_response (Dict[str, Any]): The JSON response dictionary to extract the "method" from.
 
-    Returns:
-        Dict[str, Any] | None: The value of the "method" key if it exists, otherwise None.
+async def _handle_server_respones(
+    reader: asyncio.StreamReader,
+) -> AsyncGenerator[Dict[str, Any], Any]:
     """
-    try:
-        return json_response["method"]
-    except JSONDecodeError as _:
-        return None
+    Asynchronously handles server responses by reading JSON-RPC messages
+    from the provided `asyncio.StreamReader`.
 
+    Whatever the stream has buffered is read at once and every complete
+    message in it is parsed in place, so a burst of small messages costs a
+    single read. Only an incomplete message at the end is kept for the next
+    read.
 
-# TODO: Remove unused function
-async def _handle_json_data(json_data, configs: Configs) -> Dict[str, Any] | None:
-    """
-    Handles the processing of JSON data received from a remote source.
+    This function yields each JSON-RPC response as a dictionary.
 
     Args:
-        json_data (str): The JSON data to be processed.
-        configs (Configs): The configuration settings to use during processing.
-
-    Returns:
-        Dict[str, Any] | None: The extracted "method" or "result" from the JSON response,
-        or the original JSON response if neither "method" nor "result" is present.
-    """
-    json_response: Dict[str, Any] = pd.from_json(json_data)
-    if await _has_method(json_response):
-        logger.debug(
-            "Method: %s, params: %s",
-            json_response["method"],
-            json_response.get("params"),
-        )
-        return await _extraxt_method(json_response)
-
-    if await _has_result(json_response):
-        result = await _extraxt_result(json_response)
-        logger.debug("Result: %s", result)
-        return result
-
-    return json_response
+        reader: The `asyncio.StreamReader` to read the JSON-RPC messages from.
 
+    Yields:
+        A dictionary representing the JSON-RPC response.
 
-async def _show_last_message(
+    Raises:
+        asyncio.IncompleteReadError: If the stream ends.
+        ValueError: If a message header has no valid Content-Length.
+    """
+    pending = bytearray()
+    while True:
+        chunk = await reader.read(configs.READ_BUFFER_LIMIT)
+        if not chunk:
+            raise asyncio.IncompleteReadError(bytes(pending), None)
+
+        # Parse straight from the chunk unless a message is split across reads
+        if pending:
+            pending += chunk
+            data = pending
+        else:
+            data = chunk
+
+        consumed = 0
+        with memoryview(data) as view:
+            while (header_end := data.find(b"\r\n\r\n", consumed)) >= 0:
+                content_length = _parse_content_length(data, consumed, header_end)
+                body_start = header_end + 4
+                body_end = body_start + content_length
+                if body_end > len(data):
+                    break
+                yield _loads(view[body_start:body_end])
+                consumed = body_end
+
+        if data is pending:
+            del pending[:consumed]
+        else:
+            pending += chunk[consumed:]
+
+
+def _show_last_message(
     messages: Dict[str, Any],
     show_context_files: bool,
 ) -> Tuple[str, str, list[str]]:
@@ -201,34 +291,25 @@ async def _show_last_message(
         Tuple[str, str]: A tuple containing the speaker and text of the last message.
     """
     if messages is not None and messages["type"] == "transcript":
-        last_message = messages["messages"][-1:][0]
+        last_message = messages["messages"][-1]
         logger.debug("Last message: %s", last_message)
         speaker: str = last_message["speaker"]
         text: str = last_message["text"]
 
-        context_file_results = []
+        context_file_results: list[str] = []
         if show_context_files:
-            context_files: list[any] = messages["messages"]
-
-            for context_result in context_files:
-                res = (
-                    context_result["contextFiles"]
-                    if "contextFiles" in context_result
-                    else []
-                )
-                for reso in res:
-                    uri = reso["uri"]["path"]
-                    if "range" in reso:
-                        rng = reso["range"]
-                        rng_start = rng["start"]["line"]
-                        rng_end = rng["end"]["line"]
-                        context_file_results.append(f"{uri}:{rng_start}-{rng_end}")
+            context_file_results = [
+                f"{reso['uri']['path']}:{rng['start']['line']}-{rng['end']['line']}"
+                for context_result in messages["messages"]
+                for reso in context_result.get("contextFiles") or ()
+                if (rng := reso.get("range"))
+            ]
 
         return speaker, text, context_file_results
     return ("", "", [])
 
 
-async def _show_messages(message, configs: Configs) -> None:
+def _show_messages(message, configs: Configs) -> None:
     """
     Prints the speaker and text of each message in a transcript.
 
@@ -241,34 +322,197 @@ async def _show_messages(message, configs: Configs) -> None:
     Returns:
         None
     """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
     if message["type"] == "transcript":
-        for message in message["messages"]:
-            logger.debug("%s: %s", message["speaker"], message["text"])
+        for msg in message["messages"]:
+            logger.debug("%s: %s", msg["speaker"], msg["text"])
+
+
+async def _dispatch_server_responses(
+    reader: asyncio.StreamReader,
+    pending: Dict[int, Tuple[asyncio.Future, float]],
+    listeners: Dict[str, Set[asyncio.Queue]] | None = None,
+) -> None:
+    """
+    Reads JSON-RPC messages from the server for as long as the connection is
+    open and resolves the pending request futures by their JSON-RPC id.
+
+    This allows several requests to be in flight at the same time. A request
+    fails with an AgentRequestError if the server answers it with an error,
+    or stays silent for the read timeout after it was sent.
 
+    Args:
+        reader: The `asyncio.StreamReader` to read the JSON-RPC messages from.
+        pending: The futures of the requests awaiting a response and the loop
+                 time they were sent at, keyed by id.
+        listeners: Queues receiving the params of the notifications sent by the
+                   server, keyed by method name.
+    """
+    loop = asyncio.get_running_loop()
+    last_message = loop.time()
+    watchdog: asyncio.TimerHandle | None = None
+
+    def _check_silence() -> None:
+        # A single timer re-armed for the earliest deadline, instead of a
+        # timeout around every read. A request times out once the server has
+        # been silent for the read timeout since it was sent.
+        nonlocal watchdog
+        now = loop.time()
+        next_check = now + _READ_TIMEOUT
+        for message_id, (future, sent_at) in list(pending.items()):
+            deadline = max(sent_at, last_message) + _READ_TIMEOUT
+            if deadline <= now:
+                del pending[message_id]
+                if not future.done():
+                    future.set_exception(
+                        AgentRequestError(
+                            f"No response from the Cody agent within {_READ_TIMEOUT}s"
+                        )
+                    )
+            else:
+                next_check = min(next_check, deadline)
+        watchdog = loop.call_at(next_check, _check_silence)
+
+    _check_silence()
+    try:
+        async for response in _handle_server_respones(reader):
+            last_message = loop.time()
+            method = response.get("method")
+            if method is not None:
+                # A notification or a request from the agent, not a response
+                params = response.get("params")
+                if (
+                    stream_logger.isEnabledFor(logging.DEBUG)
+                    and isinstance(params, dict)
+                    and params.get("isMessageInProgress")
+                ):
+                    stream_logger.debug("InProgress response: %s", response)
+                if listeners and (queues := listeners.get(method)):
+                    for queue in queues:
+                        queue.put_nowait(params)
+                continue
 
-async def request_response(method_name: str, params, reader, writer) -> Any:
+            logger.debug("Response: %s", response)
+            if (error := response.get("error")) is not None:
+                logger.error("Request failed: %s", error)
+            entry = pending.pop(response.get("id"), None)
+            if entry is None or entry[0].done():
+                continue
+            if error is not None:
+                entry[0].set_exception(AgentRequestError(f"Request failed: {error}"))
+            else:
+                entry[0].set_result(response.get("result"))
+    except Exception as exc:  # pylint: disable=broad-except
+        # The stream can't be read past this point, so fail the waiting
+        # requests instead of leaving them hanging.
+        if pending:
+            logger.error("Reading from the Cody agent failed: %r", exc)
+        for future, _ in pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        pending.clear()
+    finally:
+        watchdog.cancel()
+
+
+async def request_response(
+    method_name: str,
+    params,
+    writer: asyncio.StreamWriter,
+    pending: Dict[int, Tuple[asyncio.Future, float]],
+    batcher: _BatchingDispatcher | None = None,
+    raise_on_error: bool = False,
+) -> Any:
     """
-    Sends a JSON-RPC request to a server and handles the response.
+    Sends a JSON-RPC request to a server and waits for its response.
 
     Args:
         method_name (str): The name of the JSON-RPC method to call.
         params: The parameters to pass to the JSON-RPC method.
-        reader (asyncio.StreamReader): The reader stream to use for receiving responses.
         writer (asyncio.StreamWriter): The writer stream to use for sending requests.
+        pending (Dict[int, Tuple[asyncio.Future, float]]): The pending requests resolved
+                                                           by `_dispatch_server_responses`.
+        batcher (_BatchingDispatcher | None): Coalesces the request with others
+                                              sent at the same time, if given.
+        raise_on_error (bool): Whether to raise if the request failed or timed out,
+                               instead of returning None.
 
     Returns:
         Any: The result of the JSON-RPC request, or None if no result is available.
+
+    Raises:
+        AgentRequestError: If `raise_on_error` is set and the request failed or timed out.
     """
     logger.debug("Sending command: %s - %s", method_name, params)
-    await _send_jsonrpc_request(writer, method_name, params)
-    async for response in _handle_server_respones(reader):
-        params = response.get("params", {})
-        if not isinstance(params, dict):
-            continue
-        if params.get("isMessageInProgress"):
-            stream_logger.debug("InProgress response: %s", response)
-        if response and await _has_result(response):
-            logger.debug("Response: %s", response)
-            return response["result"]
+    message_id = _next_message_id()
+    # Register before sending so the response can't arrive unnoticed
+    loop = asyncio.get_running_loop()
+    future: asyncio.Future = loop.create_future()
+    pending[message_id] = (future, loop.time())
+    try:
+        if batcher is None:
+            await _send_jsonrpc_request(writer, method_name, params, message_id)
+        else:
+            frame = _encode_jsonrpc_request(method_name, params, message_id)
+            await batcher.send(frame)
+        try:
+            return await future
+        except AgentRequestError:
+            if raise_on_error:
+                raise
+            return None
+    finally:
+        pending.pop(message_id, None)
+
+
+async def batched_request_response(
+    calls: list[Tuple[str, Any]],
+    writer: asyncio.StreamWriter,
+    pending: Dict[int, Tuple[asyncio.Future, float]],
+) -> list[Any]:
+    """
+    Sends several independent JSON-RPC requests in a single write and waits
+    for all of their responses.
 
-    return None
+    Args:
+        calls (list[Tuple[str, Any]]): The (method name, params) pairs to send.
+        writer (asyncio.StreamWriter): The writer stream to use for sending requests.
+        pending (Dict[int, Tuple[asyncio.Future, float]]): The pending requests resolved
+                                                           by `_dispatch_server_responses`.
+
+    Returns:
+        list[Any]: The results of the requests, in the order of `calls`.
+    """
+    loop = asyncio.get_running_loop()
+    message_ids: list[int] = []
+    futures: list[asyncio.Future] = []
+    frames: list[bytes] = []
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for method_name, params in calls:
+        if debug:
+            logger.debug("Sending command: %s - %s", method_name, params)
+        message_id = _next_message_id()
+        future: asyncio.Future = loop.create_future()
+        pending[message_id] = (future, loop.time())
+        message_ids.append(message_id)
+        futures.append(future)
+        frames.append(_encode_jsonrpc_request(method_name, params, message_id))
+    try:
+        writer.writelines(frames)
+        if _needs_drain(writer):
+            await writer.drain()
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(
+                result, AgentRequestError
+            ):
+                raise result
+        # Failed and timed out requests resolve to None, like request_response
+        return [
+            None if isinstance(result, AgentRequestError) else result
+            for result in results
+        ]
+    finally:
+        for message_id in message_ids:
+            pending.pop(message_id, None)
@@ -0,0 +1,194 @@
+import asyncio
+import contextlib
+import logging
+from collections import deque
+from typing import AsyncIterator
+
+from codypy.agent import CodyAgent
+from codypy.client_info import AgentSpecs
+from codypy.server import CodyServer
+
+logger = logging.getLogger(__name__)
+
+
+class CodyServerPool:
+    """
+    Keeps initialized Cody agents alive between uses, so callers that need an
+    agent for a short task don't pay for the agent process start-up and the
+    "initialize" handshake every time.
+
+    Agents are created on demand up to `max_size` and shut down once they have
+    been idle for `idle_ttl` seconds. An agent handed out by `acquire` keeps the
+    chat state of its previous user, call `CodyAgent.new_chat` before chatting.
+
+    The agents always talk to their process via stdio, as the TCP connection
+    uses a fixed port that several agents can't share.
+    """
+
+    _pools: dict[tuple, "CodyServerPool"] = {}
+
+    @classmethod
+    def shared(
+        cls,
+        binary_path: str,
+        version: str,
+        agent_specs: AgentSpecs,
+        **kwargs,
+    ) -> "CodyServerPool":
+        """
+        Returns the process-wide pool for the given binary and agent specs,
+        creating it on first use.
+
+        Args:
+            binary_path (str): The directory of the Cody Agent binary.
+            version (str): The version of the Cody Agent binary.
+            agent_specs (AgentSpecs): The specs the pooled agents are initialized with.
+            **kwargs: Passed on to the pool if it is created.
+
+        Returns:
+            CodyServerPool: The pool for the given arguments.
+        """
+        key = (binary_path, version, agent_specs.json_bytes)
+        pool = cls._pools.get(key)
+        if pool is None:
+            pool = cls._pools[key] = cls(binary_path, version, agent_specs, **kwargs)
+        return pool
+
+    def __init__(
+        self,
+        binary_path: str,
+        version: str,
+        agent_specs: AgentSpecs,
+        max_size: int = 4,
+        idle_ttl: float = 300.0,
+    ) -> None:
+        self.binary_path = binary_path
+        self.version = version
+        # A copy, so later changes to the caller's specs don't affect the
+        # agents started here or the key the pool is shared under
+        self.agent_specs = agent_specs.model_copy(deep=True)
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        # Idle entries of (released at, server, agent), most recently used last
+        self._idle: deque[tuple[float, CodyServer, CodyAgent]] = deque()
+        self._size = 0
+        self._condition = asyncio.Condition()
+        self._reaper_task: asyncio.Task | None = None
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncIterator[CodyAgent]:
+        """
+        Hands out an initialized agent for the duration of the `async with` block.
+        Waits for an agent to be released if `max_size` agents are in use.
+
+        If the block raises, the agent may be in the middle of a request and is
+        shut down instead of being returned to the pool.
+
+        Yields:
+            CodyAgent: An initialized agent.
+        """
+        server, agent = await self._checkout()
+        try:
+            yield agent
+        except BaseException:
+            await self._discard(server)
+            raise
+        await self._release(server, agent)
+
+    async def close(self) -> None:
+        """
+        Shuts down all idle agents and stops the idle reaper. Agents still in
+        use are shut down when they are released.
+        """
+        if self._reaper_task is not None:
+            self._reaper_task.cancel()
+            self._reaper_task = None
+        async with self._condition:
+            idle, self._idle = self._idle, deque()
+            self._size -= len(idle)
+            self.max_size = 0
+            self._condition.notify_all()
+        for _, server, _ in idle:
+            await self._shutdown(server)
+        for key, pool in list(self._pools.items()):
+            if pool is self:
+                del self._pools[key]
+
+    async def _checkout(self) -> tuple[CodyServer, CodyAgent]:
+        async with self._condition:
+            while True:
+                while self._idle:
+                    _, server, agent = self._idle.pop()
+                    if self._is_alive(server):
+                        return server, agent
+                    logger.info("Evicting exited Cody agent from the pool")
+                    self._size -= 1
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                await self._condition.wait()
+
+        try:
+            return await self._start()
+        except BaseException:
+            async with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+    async def _start(self) -> tuple[CodyServer, CodyAgent]:
+        server = await CodyServer.init(
+            binary_path=self.binary_path,
+            version=self.version,
+        )
+        agent = CodyAgent(cody_server=server, agent_specs=self.agent_specs)
+        try:
+            await agent.initialize_agent()
+        except BaseException:
+            await self._shutdown(server)
+            raise
+        logger.info("Started pooled Cody agent (%d/%d)", self._size, self.max_size)
+        return server, agent
+
+    async def _release(self, server: CodyServer, agent: CodyAgent) -> None:
+        if not self._is_alive(server) or self._size > self.max_size:
+            await self._discard(server)
+            return
+        async with self._condition:
+            self._idle.append((asyncio.get_running_loop().time(), server, agent))
+            self._condition.notify()
+        if self._reaper_task is None:
+            self._reaper_task = asyncio.create_task(self._reap_idle())
+
+    async def _discard(self, server: CodyServer) -> None:
+        async with self._condition:
+            self._size -= 1
+            self._condition.notify()
+        await self._shutdown(server)
+
+    async def _reap_idle(self) -> None:
+        """Shuts down agents that have been idle for longer than `idle_ttl`."""
+        loop = asyncio.get_running_loop()
+        while self._idle:
+            await asyncio.sleep(self.idle_ttl / 2)
+            expired = []
+            async with self._condition:
+                deadline = loop.time() - self.idle_ttl
+                while self._idle and self._idle[0][0] <= deadline:
+                    expired.append(self._idle.popleft())
+                self._size -= len(expired)
+                self._condition.notify(len(expired))
+            for _, server, _ in expired:
+                logger.info("Shutting down Cody agent idle for %ss", self.idle_ttl)
+                await self._shutdown(server)
+        self._reaper_task = None
+
+    @staticmethod
+    def _is_alive(server: CodyServer) -> bool:
+        return server._process is not None and server._process.returncode is None
+
+    @staticmethod
+    async def _shutdown(server: CodyServer) -> None:
+        # The process may already be gone, there is nothing left to do then
+        with contextlib.suppress(Exception):
+            await server.cleanup_server()
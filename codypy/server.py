@@ -1,14 +1,30 @@
 import asyncio
+import contextlib
 import logging
 import os
-from asyncio.subprocess import Process
+import random
+import socket
+from asyncio.subprocess import Process, SubprocessStreamProtocol
+from typing import Any, Iterator
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from codypy.config import configs
 from codypy.exceptions import (
     AgentBinaryDownloadError,
     AgentBinaryNotFoundError,
     ServerTCPConnectionError,
 )
-from codypy.messaging import _send_jsonrpc_request
+from codypy.messaging import (
+    _BatchingDispatcher,
+    _dispatch_server_responses,
+    _send_jsonrpc_request,
+    batched_request_response,
+    request_response,
+)
 from codypy.utils import (
     _check_for_binary_file,
     _download_binary_to_path,
@@ -17,9 +33,43 @@ from codypy.utils import (
 
 logger = logging.getLogger(__name__)
 
+# Chat transcripts arrive as single JSON-RPC messages that can be far larger
+# than asyncio's default 64 KiB stream buffer. A larger reader limit (see
+# Configs.READ_BUFFER_LIMIT) and larger OS pipe buffers let them pass in
+# fewer reads and writes.
+_PIPE_SIZE = 1 << 20
+
+
+def _grow_pipe_buffer(pipe) -> None:
+    """
+    Grows the kernel buffer of the given pipe to `_PIPE_SIZE` bytes.
+
+    This is only supported on Linux, elsewhere the pipe is left as is. On
+    Windows the buffer size of the pipes asyncio creates is fixed and small,
+    which makes large messages noticeably slower to transfer there.
+
+    Args:
+        pipe: The pipe file object, or None.
+    """
+    if pipe is None or fcntl is None or not hasattr(fcntl, "F_SETPIPE_SZ"):
+        return
+    try:
+        fcntl.fcntl(pipe.fileno(), fcntl.F_SETPIPE_SZ, _PIPE_SIZE)
+    except OSError as err:
+        # Unprivileged processes are capped by /proc/sys/fs/pipe-max-size
+        logger.debug("Could not grow the pipe buffer: %s", err)
+
+
+# Agent binaries found on disk, keyed by (binary_path, version). Misses are
+# not cached, so a fixed path or a finished download is picked up next time.
+_RESOLVED_BINARIES: dict[tuple[str, str], str] = {}
+
 
 async def _get_cody_binary(binary_path: str, version: str) -> str:
-    print(f"Checking for Cody Agent binary at {binary_path}")
+    if cody_binary := _RESOLVED_BINARIES.get((binary_path, version)):
+        return cody_binary
+
+    logger.info("Checking for Cody Agent binary at %s", binary_path)
     has_agent_binary = await _check_for_binary_file(binary_path, "cody-agent", version)
     if not has_agent_binary:
         logger.warning(
@@ -32,28 +82,81 @@ async def _get_cody_binary(binary_path: str, version: str) -> str:
         if not is_completed:
             raise AgentBinaryDownloadError("Failed to download the Cody Agent binary")
 
-    return os.path.join(binary_path, await _format_binary_name("cody-agent", version))
+    cody_binary = os.path.join(
+        binary_path, await _format_binary_name("cody-agent", version)
+    )
+    _RESOLVED_BINARIES[(binary_path, version)] = cody_binary
+    return cody_binary
 
 
 class CodyServer:
+    __slots__ = (
+        "cody_binary",
+        "use_tcp",
+        "_process",
+        "_reader",
+        "_writer",
+        "_pending",
+        "_listeners",
+        "_reader_task",
+        "batch_window_ms",
+        "max_batch",
+        "_batcher",
+        "max_in_flight",
+        "_in_flight",
+    )
+
     @classmethod
     async def init(
         cls,
         binary_path: str,
         version: str,
         use_tcp: bool = False,  # default because of ca-certificate verification
+        batch_window_ms: float = 0.0,
+        max_batch: int = 16,
+        max_in_flight: int = 256,
     ) -> "CodyServer":
         cody_binary = await _get_cody_binary(binary_path, version)
-        cody_server = cls(cody_binary, use_tcp)
+        cody_server = cls(
+            cody_binary, use_tcp, batch_window_ms, max_batch, max_in_flight
+        )
         await cody_server._create_server_connection()
         return cody_server
 
-    def __init__(self, cody_binary: str, use_tcp: bool) -> None:
+    def __init__(
+        self,
+        cody_binary: str,
+        use_tcp: bool,
+        batch_window_ms: float = 0.0,
+        max_batch: int = 16,
+        max_in_flight: int = 256,
+    ) -> None:
+        """
+        Args:
+            cody_binary (str): The path of the Cody Agent binary.
+            use_tcp (bool): Whether to connect to the agent via TCP instead of stdio.
+            batch_window_ms (float): How long to hold back a request so that requests
+                                     sent concurrently go out in a single write.
+                                     0 sends every request right away.
+            max_batch (int): The number of held back requests after which they are
+                             written without waiting for the window to end.
+            max_in_flight (int): The number of requests awaiting a response at the same
+                                 time. Further requests wait until one completes.
+        """
         self.cody_binary = cody_binary
         self.use_tcp = use_tcp
+        self.batch_window_ms = batch_window_ms
+        self.max_batch = max_batch
+        self._batcher: _BatchingDispatcher | None = None
+        self.max_in_flight = max_in_flight
+        self._in_flight = asyncio.Semaphore(max_in_flight)
         self._process: Process | None = None
         self._reader: asyncio.StreamReader | None = None
         self._writer: asyncio.StreamWriter | None = None
+        # Futures of the requests awaiting a response and when they were sent
+        self._pending: dict[int, tuple[asyncio.Future, float]] = {}
+        self._listeners: dict[str, set[asyncio.Queue]] = {}
+        self._reader_task: asyncio.Task | None = None
 
     async def _create_server_connection(
         self, test_against_node_source: bool = False
@@ -64,7 +167,7 @@ class CodyServer:
         Sets the `CODY_AGENT_DEBUG_REMOTE` and `CODY_DEBUG` environment variables based on the `use_tcp` and `is_debugging` flags, respectively.
         Creates a subprocess to run the Cody agent, either by executing the `bin/agent` binary or running the `index.js` file specified by `binary_path`.
         Depending on the `use_tcp` flag, it either connects to the agent using stdio or opens a TCP connection to `localhost:3113`.
-        If the TCP connection fails after 5 retries, it prints an error message and exits the program.
+        If the TCP connection still fails after retrying for about 5 seconds, it raises a ServerTCPConnectionError.
         Returns the reader and writer streams for the agent connection.
         """
         if not test_against_node_source and self.cody_binary == "":
@@ -75,8 +178,11 @@ class CodyServer:
             )
 
         debug = logger.getEffectiveLevel() == logging.DEBUG
-        os.environ["CODY_AGENT_DEBUG_REMOTE"] = str(self.use_tcp).lower()
-        os.environ["CODY_DEBUG"] = str(debug).lower()
+        env = {
+            **os.environ,
+            "CODY_AGENT_DEBUG_REMOTE": str(self.use_tcp).lower(),
+            "CODY_DEBUG": str(debug).lower(),
+        }
 
         args = []
         binary = ""
@@ -92,43 +198,54 @@ class CodyServer:
             binary = self.cody_binary
         args.append("api")
         args.append("jsonrpc-stdio")
-        self._process: Process = await asyncio.create_subprocess_exec(
+        # Spawned through the loop instead of asyncio.create_subprocess_exec
+        # to keep the subprocess transport, the public handle on the pipes
+        loop = asyncio.get_running_loop()
+        process_transport, protocol = await loop.subprocess_exec(
+            lambda: SubprocessStreamProtocol(
+                limit=configs.READ_BUFFER_LIMIT, loop=loop
+            ),
             binary,
             *args,
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
-            env=os.environ,
+            env=env,
         )
+        self._process = Process(process_transport, protocol, loop)
         logger.info("Cody agent process with PID %d created", self._process.pid)
-        self._reader = self._process.stdout
-        self._writer = self._process.stdin
 
         if not self.use_tcp:
+            for fd in (0, 1):
+                pipe_transport = process_transport.get_pipe_transport(fd)
+                _grow_pipe_buffer(pipe_transport.get_extra_info("pipe"))
+            self._reader = self._process.stdout
+            self._writer = self._process.stdin
             logger.info("Created a stdio connection to the Cody agent")
         else:
-            retry: int = 0
-            retry_attempts: int = 5
+            retry_attempts: int = 16
             # TODO: Consider making this configurable
             host: str = "localhost"
             port: int = 3113
-            for retry in range(retry_attempts):
+            # Back off exponentially, so an agent that binds the port quickly
+            # is connected to right away while a slow start still gets 5s or more.
+            # The jitter keeps clients started together from retrying in step.
+            delay: float = 0.02
+            max_delay: float = 0.5
+            for retry in range(1, retry_attempts + 1):
                 try:
-                    (self._reader, self._writer) = await asyncio.open_connection(
-                        host, port
+                    self._reader, self._writer = await asyncio.wait_for(
+                        asyncio.open_connection(
+                            host, port, limit=configs.READ_BUFFER_LIMIT
+                        ),
+                        timeout=1.0,
                     )
-                    if self._reader is not None and self._writer is not None:
-                        logger.info(
-                            "Created a TCP connection to the Cody agent (%s:%s)",
-                            host,
-                            port,
-                        )
-                        break
-                    # return reader, writer, process
-                except ConnectionRefusedError as exc:
-                    # TODO: This is not the nicest way to do retry but it
-                    # keeps the logging sane. Consider refactoring.
-                    await asyncio.sleep(1)  # Retry after a short delay
-                    retry += 1
+                    logger.info(
+                        "Created a TCP connection to the Cody agent (%s:%s)",
+                        host,
+                        port,
+                    )
+                    break
+                except (ConnectionRefusedError, asyncio.TimeoutError) as exc:
                     if retry == retry_attempts:
                         logger.debug(
                             "Exhausted %d retry attempts while trying to connect to %s:%s",
@@ -137,22 +254,137 @@ class CodyServer:
                             port,
                         )
                         raise ServerTCPConnectionError(
-                            "Could not connect to server: %s:%s", host, port
+                            f"Could not connect to server: {host}:{port}"
                         ) from exc
-                    else:
-                        logger.debug(
-                            "Connection to %s:%s failed, retrying (%d)",
-                            host,
-                            port,
-                            retry,
-                        )
+                    wait = delay + random.uniform(0, delay / 2)
+                    logger.debug(
+                        "Connection to %s:%s failed, retrying in %.2fs (%d)",
+                        host,
+                        port,
+                        wait,
+                        retry,
+                    )
+                    await asyncio.sleep(wait)
+                    delay = min(delay * 2, max_delay)
+
+        transport = self._writer.transport
+        if configs.ZERO_WRITE_BUFFER:
+            # drain() then waits until every request has reached the agent
+            transport.set_write_buffer_limits(0)
+        if self.use_tcp:
+            sock = transport.get_extra_info("socket")
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, configs.TCP_NODELAY)
+
+        if self.batch_window_ms > 0:
+            self._batcher = _BatchingDispatcher(
+                self._writer, self.batch_window_ms / 1000, self.max_batch
+            )
+        self._reader_task = asyncio.create_task(
+            _dispatch_server_responses(self._reader, self._pending, self._listeners)
+        )
+
+    async def request_response(
+        self, method_name: str, params, raise_on_error: bool = False
+    ) -> Any:
+        """
+        Sends a JSON-RPC request to the Cody agent and waits for its response.
+        Requests may be awaited concurrently, responses are matched by their id.
+
+        Args:
+            method_name (str): The name of the JSON-RPC method to call.
+            params: The parameters to pass to the JSON-RPC method.
+            raise_on_error (bool): Whether to raise if the request failed or timed out,
+                                   instead of returning None.
+
+        Returns:
+            Any: The result of the JSON-RPC request, or None if no result is available.
+
+        Raises:
+            AgentRequestError: If `raise_on_error` is set and the request failed or timed out.
+        """
+        async with self._in_flight:
+            self._check_connection()
+            return await request_response(
+                method_name,
+                params,
+                self._writer,
+                self._pending,
+                self._batcher,
+                raise_on_error,
+            )
+
+    def _check_connection(self) -> None:
+        # Once the reader task has stopped nothing resolves new requests, so
+        # fail them right away instead of leaving them hanging
+        if self._reader_task is not None and self._reader_task.done():
+            raise ConnectionResetError("Connection lost")
+
+    @contextlib.contextmanager
+    def notifications(self, method_name: str) -> Iterator[asyncio.Queue]:
+        """
+        Subscribes to the notifications the Cody agent sends for the given
+        method for the duration of the `with` block.
+
+        Args:
+            method_name (str): The name of the JSON-RPC notification, e.g. "webview/postMessage".
+
+        Yields:
+            asyncio.Queue: A queue receiving the params of every such notification.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        self._listeners.setdefault(method_name, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            queues = self._listeners[method_name]
+            queues.discard(queue)
+            if not queues:
+                del self._listeners[method_name]
+
+    async def batched_request_response(self, calls: list[tuple[str, Any]]) -> list[Any]:
+        """
+        Sends several independent JSON-RPC requests to the Cody agent in a
+        single write, saving a flush per request, and waits for all responses.
+
+        Args:
+            calls (list[tuple[str, Any]]): The (method name, params) pairs to send.
+
+        Returns:
+            list[Any]: The results of the requests, in the order of `calls`.
+
+        Raises:
+            ValueError: If there are more calls than `max_in_flight`.
+        """
+        if len(calls) > self.max_in_flight:
+            raise ValueError(
+                f"Can't send {len(calls)} requests at once, "
+                f"max_in_flight is {self.max_in_flight}"
+            )
+        # Every call counts against max_in_flight, like a single request
+        acquired = 0
+        try:
+            for _ in calls:
+                await self._in_flight.acquire()
+                acquired += 1
+            self._check_connection()
+            if self._batcher is not None:
+                # Requests held back before this batch must be written first
+                self._batcher.flush()
+            return await batched_request_response(calls, self._writer, self._pending)
+        finally:
+            for _ in range(acquired):
+                self._in_flight.release()
 
     async def cleanup_server(self):
         """
         Cleans up the server connection by sending a "shutdown" request to the server and terminating the server process if it is still running.
         """
         logger.info("Cleaning up Server...")
+        if self._batcher is not None:
+            self._batcher.flush()
         await _send_jsonrpc_request(self._writer, "shutdown", None)
         if self._process.returncode is None:
             self._process.terminate()
         await self._process.wait()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
@@ -1,13 +1,11 @@
+import functools
+import logging
 import os
 import platform
-from typing import Any
+import shlex
 import tarfile
 
-import aiofiles
-import aiohttp
-
-from codypy.config import Configs
-from codypy.messaging import request_response
+logger = logging.getLogger(__name__)
 
 
 async def _get_platform_arch() -> str | None:
@@ -17,6 +15,12 @@ async def _get_platform_arch() -> str | None:
     Returns:
         str | None: A string representing the platform and architecture, or None if the platform/architecture could not be determined.
     """
+    return _detect_platform_arch()
+
+
+@functools.cache
+def _detect_platform_arch() -> str | None:
+    # The platform can't change while running, so this is only detected once
     system = platform.system().lower()
     machine = platform.machine().lower()
 
@@ -124,6 +128,10 @@ async def _download_binary_to_path(
     Returns:
         None
     """
+    # Only needed for the one-off download, keep them out of `import codypy`
+    import aiofiles
+    import aiohttp
+
     cody_agent = await _format_binary_name(cody_name, version)
     cody_tar_path = os.path.join(binary_dir, f"{cody_agent}.tar.gz")
     os.makedirs(binary_dir, exist_ok=True)
@@ -134,34 +142,38 @@ async def _download_binary_to_path(
             f"https://registry.npmjs.org/@sourcegraph/cody/-/cody-{version}.tgz"
         ) as response:
             if response.status != 200:
-                print(f"HTTP error occurred: {response.status}")
+                logger.error("HTTP error occurred: %s", response.status)
                 return False
 
             try:
                 async with aiofiles.open(cody_tar_path, "wb") as f:
                     content = await response.read()
                     await f.write(content)
-                    print(f"Downloaded {cody_agent} to {binary_dir}")
+                    logger.info("Downloaded %s to %s", cody_agent, binary_dir)
             except Exception as err:
-                print(f"Error occurred while writing the file: {err}")
+                logger.error("Error occurred while writing the file: %s", err)
                 return False
 
     try:
         with tarfile.open(cody_tar_path, "r:gz") as tar:
             tar.extractall(path=binary_dir)
-        print(f"Extracted {cody_agent} to {binary_dir}")
+        logger.info("Extracted %s to %s", cody_agent, binary_dir)
         
         # Remove the downloaded tar file
         os.remove(cody_tar_path)
-        print(f"Removed temporary file {cody_tar_path}")
+        logger.debug("Removed temporary file %s", cody_tar_path)
         
     except Exception as err:
-        print(f"Error occurred while extracting the file: {err}")
+        logger.error("Error occurred while extracting the file: %s", err)
         return False
     
     # Create a script that runs `node package/dist/index.js`
     index_js = os.path.join(binary_dir, "package", "dist", "index.js")
-    script_content = f'#!/bin/sh\nnode {index_js} "$@"' if os.name != 'nt' else f'node "{index_js}" $args'
+    script_content = (
+        f'#!/bin/sh\nnode {shlex.quote(index_js)} "$@"'
+        if os.name != "nt"
+        else f'node "{index_js}" $args'
+    )
     
     try:
         with open(cody_binary_path, 'w') as f:
@@ -171,28 +183,8 @@ async def _download_binary_to_path(
         if os.name != 'nt':
             os.chmod(cody_binary_path, 0o755)
         
-        print(f"Created executable script at {cody_binary_path}")
+        logger.info("Created executable script at %s", cody_binary_path)
         return True
     except Exception as err:
-        print(f"Error occurred while creating the script: {err}")
+        logger.error("Error occurred while creating the script: %s", err)
         return False
-
-
-
-async def get_remote_repositories(
-    reader,
-    writer,
-    id: str,
-    configs: Configs,
-) -> Any:
-    return await request_response("chat/remoteRepos", id, reader, writer, configs)
-
-
-async def receive_webviewmessage(reader, writer, params, configs: Configs) -> Any:
-    return await request_response(
-        "webview/receiveMessage",
-        params,
-        reader,
-        writer,
-        configs,
-    )
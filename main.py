@@ -10,6 +10,12 @@ from codypy.config import BLUE, GREEN, RESET
 from codypy.context import append_paths
 from codypy.server import CodyServer
 
+# uvloop is an optional, faster event loop, the default one works as well
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 load_dotenv()
 SRC_ACCESS_TOKEN = os.getenv("SRC_ACCESS_TOKEN")
 BINARY_PATH = os.getenv("BINARY_PATH")
@@ -50,21 +56,15 @@ async def main():
     cody_agent: CodyAgent = CodyAgent(cody_server=cody_server, agent_specs=agent_specs)
     await cody_agent.initialize_agent()
 
-    # Retrieve and print the available chat models
-    logger.info("--- Retrieve Chat Models ---")
-    models = await cody_agent.get_models(model_type="chat")
-    logger.info("Available models: %s", models)
-    # Create a new chat with the CodyAgent
+    # Create a new chat with the CodyAgent, set the chat model to Claude3Sonnet
+    # and the repository context. Requests that don't depend on each other are
+    # sent together.
     logger.info("--- Create new chat ---")
-    await cody_agent.new_chat()
-
-    # Set the chat model to Claude3Haiku
-    logger.info("--- Set Model ---")
-    await cody_agent.set_model(model=Models.Claude3Sonnet)
-
-    # Set the repository context
-    logger.info("--- Set context repo ---")
-    await cody_agent.set_context_repo(repos=["github.com/PriNova/codypy"])
+    models = await cody_agent.bootstrap(
+        model=Models.Claude3Sonnet,
+        repos=["github.com/PriNova/codypy"],
+    )
+    logger.info("Available models: %s", models)
 
     # Send a message to the chat and print the response until the user enters '/quit'.
     logger.info("--- Send message (short) ---")
@@ -103,4 +103,7 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
@@ -26,5 +26,5 @@ setup(
         "License :: MIT License",
         "Programming Language :: Python :: 3.12",
     ],
-    python_requires=">=3.7",
+    python_requires=">=3.10",
 )
@@ -0,0 +1,82 @@
+import asyncio
+
+from codypy.agent import CodyAgent
+from codypy.client_info import AgentSpecs
+from codypy.server import CodyServer
+
+
+def _transcript(text: str) -> dict:
+    return {
+        "type": "transcript",
+        "messages": [
+            {"speaker": "human", "text": "Hi"},
+            {"speaker": "assistant", "text": text},
+        ],
+    }
+
+
+class _FakeServer(CodyServer):
+    """
+    Posts `updates` as "webview/postMessage" notifications while a chat
+    message is submitted, then answers with `final`, or never if it is None.
+    """
+
+    def __init__(self, updates: list[tuple[str, str]], final: str | None) -> None:
+        super().__init__(cody_binary="", use_tcp=False)
+        self.updates = updates
+        self.final = final
+        self.submit_cancelled = False
+
+    async def request_response(self, method_name, params, raise_on_error=False):
+        assert method_name == "chat/submitMessage"
+        for chat_id, text in self.updates:
+            for queue in self._listeners.get("webview/postMessage", ()):
+                queue.put_nowait({"id": chat_id, "message": _transcript(text)})
+            await asyncio.sleep(0)
+        if self.final is None:
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                self.submit_cancelled = True
+                raise
+        return _transcript(self.final)
+
+
+def _agent(server: _FakeServer) -> CodyAgent:
+    agent = CodyAgent(cody_server=server, agent_specs=AgentSpecs())
+    agent.chat_id = "chat-1"
+    return agent
+
+
+def test_chat_stream_yields_the_added_text():
+    server = _FakeServer(
+        updates=[("chat-1", "Hel"), ("chat-2", "Other chat"), ("chat-1", "Hello")],
+        final="Hello world",
+    )
+
+    async def run() -> list[tuple[str, str]]:
+        return [item async for item in _agent(server).chat_stream("Hi")]
+
+    assert asyncio.run(run()) == [
+        ("assistant", "Hel"),
+        ("assistant", "lo"),
+        ("assistant", " world"),
+    ]
+    assert server._listeners == {}
+
+
+def test_chat_stream_unsubscribes_when_closed_early():
+    server = _FakeServer(updates=[("chat-1", "Hel")], final=None)
+
+    async def run() -> tuple[str, str]:
+        stream = _agent(server).chat_stream("Hi")
+        first = await stream.__anext__()
+        assert server._listeners
+        await stream.aclose()
+        assert server._listeners == {}
+        # The pending submit request is cancelled along with the stream
+        await asyncio.sleep(0)
+        assert server.submit_cancelled
+        return first
+
+    assert asyncio.run(run()) == ("assistant", "Hel")
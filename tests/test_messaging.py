@@ -0,0 +1,192 @@
+import asyncio
+import json
+
+import pytest
+
+from codypy import messaging
+from codypy.exceptions import AgentRequestError
+
+
+class _FakeTransport:
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+    def get_write_buffer_limits(self) -> tuple[int, int]:
+        return (0, 0)
+
+    def is_closing(self) -> bool:
+        return False
+
+
+class _FakeWriter:
+    """Answers every request on `reader` after `delay` seconds."""
+
+    def __init__(
+        self, reader: asyncio.StreamReader, delay: float, error: dict | None = None
+    ) -> None:
+        self.transport = _FakeTransport()
+        self._reader = reader
+        self._delay = delay
+        self._error = error
+
+    def write(self, frame: bytes) -> None:
+        request = json.loads(frame.partition(b"\r\n\r\n")[2])
+        response = {"jsonrpc": "2.0", "id": request["id"]}
+        if self._error is None:
+            response["result"] = request["method"]
+        else:
+            response["error"] = self._error
+        body = json.dumps(response).encode()
+        response = b"Content-Length: %d\r\n\r\n%b" % (len(body), body)
+        asyncio.get_running_loop().call_later(
+            self._delay, self._reader.feed_data, response
+        )
+
+    async def drain(self) -> None:
+        pass
+
+
+async def _request_after_idle(
+    idle: float,
+    answer_after: float,
+    error: dict | None = None,
+    raise_on_error: bool = False,
+) -> object:
+    reader = asyncio.StreamReader()
+    pending: dict = {}
+    dispatcher = asyncio.create_task(
+        messaging._dispatch_server_responses(reader, pending)
+    )
+    try:
+        await asyncio.sleep(idle)
+        writer = _FakeWriter(reader, answer_after, error)
+        return await messaging.request_response(
+            "chat/new", None, writer, pending, raise_on_error=raise_on_error
+        )
+    finally:
+        dispatcher.cancel()
+
+
+def test_request_after_idle_connection_waits_for_response(monkeypatch):
+    monkeypatch.setattr(messaging, "_READ_TIMEOUT", 0.2)
+    # Idle for longer than the read timeout before the request is sent
+    result = asyncio.run(_request_after_idle(idle=0.3, answer_after=0.1))
+    assert result == "chat/new"
+
+
+def test_request_resolves_to_none_when_server_stays_silent(monkeypatch):
+    monkeypatch.setattr(messaging, "_READ_TIMEOUT", 0.2)
+    result = asyncio.run(_request_after_idle(idle=0.0, answer_after=1.0))
+    assert result is None
+
+
+def test_request_raises_on_timeout_when_asked(monkeypatch):
+    monkeypatch.setattr(messaging, "_READ_TIMEOUT", 0.2)
+    with pytest.raises(AgentRequestError):
+        asyncio.run(
+            _request_after_idle(idle=0.0, answer_after=1.0, raise_on_error=True)
+        )
+
+
+def test_error_response_resolves_to_none_or_raises_when_asked():
+    error = {"code": -32603, "message": "boom"}
+    assert asyncio.run(_request_after_idle(0.0, 0.01, error)) is None
+    with pytest.raises(AgentRequestError, match="boom"):
+        asyncio.run(_request_after_idle(0.0, 0.01, error, raise_on_error=True))
+
+
+class _RecordingWriter:
+    """Records every write call, each as the list of frames written."""
+
+    def __init__(self) -> None:
+        self.transport = _FakeTransport()
+        self.writes: list[list[bytes]] = []
+
+    def write(self, frame: bytes) -> None:
+        self.writes.append([frame])
+
+    def writelines(self, frames: list[bytes]) -> None:
+        self.writes.append(list(frames))
+
+    async def drain(self) -> None:
+        pass
+
+
+def test_batcher_writes_requests_of_one_window_together():
+    async def run() -> list[list[bytes]]:
+        writer = _RecordingWriter()
+        batcher = messaging._BatchingDispatcher(writer, 0.05, max_batch=16)
+        sends = [asyncio.create_task(batcher.send(b"%d" % i)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        # Still within the window, nothing is written yet
+        assert writer.writes == []
+        await asyncio.gather(*sends)
+        return writer.writes
+
+    assert asyncio.run(run()) == [[b"0", b"1", b"2"]]
+
+
+def test_batcher_writes_a_full_batch_without_waiting_for_the_window():
+    async def run() -> list[list[bytes]]:
+        writer = _RecordingWriter()
+        batcher = messaging._BatchingDispatcher(writer, 10.0, max_batch=2)
+        sends = [asyncio.create_task(batcher.send(b"%d" % i)) for i in range(2)]
+        await asyncio.wait_for(asyncio.gather(*sends), 1.0)
+        return writer.writes
+
+    assert asyncio.run(run()) == [[b"0", b"1"]]
+
+
+def test_batcher_flush_writes_queued_requests_right_away():
+    async def run() -> list[list[bytes]]:
+        writer = _RecordingWriter()
+        batcher = messaging._BatchingDispatcher(writer, 10.0, max_batch=16)
+        send = asyncio.create_task(batcher.send(b"0"))
+        await asyncio.sleep(0)
+        batcher.flush()
+        # Written by flush() itself, before the drain task runs
+        assert writer.writes == [[b"0"]]
+        await asyncio.wait_for(send, 1.0)
+        # Nothing is left to flush
+        batcher.flush()
+        return writer.writes
+
+    assert asyncio.run(run()) == [[b"0"]]
+
+
+def _content_length(header: bytes) -> int:
+    # Placed after other data, so the offsets are checked as well
+    data = b"{}" + header + b"\r\n\r\n{}"
+    return messaging._parse_content_length(data, 2, 2 + len(header))
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        b"Content-Length: 42",
+        b"Content-Length:42",
+        b"Content-Type: application/json\r\nContent-Length: 42",
+        b"Content-Length: 42\r\nContent-Type: application/json",
+    ],
+)
+def test_parse_content_length(header):
+    assert _content_length(header) == 42
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        b"",
+        b"Content-Type: application/json",
+        b"Content-Length:",
+        b"Content-Length: abc",
+        b"Content-Length: 4 2",
+        b"Content-Length: +42",
+        b"Content-Length: -42",
+        b"Content-Length: 4_2",
+        b"Content-Length: 0x2a",
+    ],
+)
+def test_parse_content_length_rejects_malformed_headers(header):
+    with pytest.raises(ValueError):
+        _content_length(header)
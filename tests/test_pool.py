@@ -0,0 +1,126 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from codypy import pool as pool_module
+from codypy.client_info import AgentSpecs
+from codypy.pool import CodyServerPool
+
+
+class _FakeServer:
+    """Stands in for a started agent process."""
+
+    started: list["_FakeServer"] = []
+
+    def __init__(self) -> None:
+        self._process = SimpleNamespace(returncode=None)
+        self.cleaned_up = False
+
+    @classmethod
+    async def init(cls, binary_path: str, version: str) -> "_FakeServer":
+        server = cls()
+        cls.started.append(server)
+        return server
+
+    async def cleanup_server(self) -> None:
+        self.cleaned_up = True
+        self._process.returncode = 0
+
+
+class _FakeAgent:
+    def __init__(self, cody_server: _FakeServer, agent_specs: AgentSpecs) -> None:
+        self.cody_server = cody_server
+
+    async def initialize_agent(self) -> None:
+        pass
+
+
+@pytest.fixture
+def make_pool(monkeypatch):
+    _FakeServer.started = []
+    monkeypatch.setattr(pool_module, "CodyServer", _FakeServer)
+    monkeypatch.setattr(pool_module, "CodyAgent", _FakeAgent)
+
+    def make_pool(**kwargs) -> CodyServerPool:
+        return CodyServerPool("/bin", "0.0.0", AgentSpecs(), **kwargs)
+
+    return make_pool
+
+
+def test_waiter_blocks_at_max_size_until_release(make_pool):
+    async def run() -> None:
+        pool = make_pool(max_size=1)
+        release = asyncio.Event()
+
+        async def hold() -> _FakeAgent:
+            async with pool.acquire() as agent:
+                await release.wait()
+                return agent
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+
+        async def wait() -> _FakeAgent:
+            async with pool.acquire() as agent:
+                return agent
+
+        waiter = asyncio.create_task(wait())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+
+        release.set()
+        first, second = await asyncio.gather(holder, waiter)
+        # The waiter is handed the released agent, no second one is started
+        assert second is first
+        assert len(_FakeServer.started) == 1
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_exited_agent_is_evicted(make_pool):
+    async def run() -> None:
+        pool = make_pool()
+        async with pool.acquire() as first:
+            pass
+        first.cody_server._process.returncode = 1
+
+        async with pool.acquire() as second:
+            assert second is not first
+        assert len(_FakeServer.started) == 2
+        assert pool._size == 1
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_agent_is_discarded_when_the_block_raises(make_pool):
+    async def run() -> None:
+        pool = make_pool()
+        with pytest.raises(RuntimeError):
+            async with pool.acquire() as agent:
+                raise RuntimeError("request failed")
+        assert agent.cody_server.cleaned_up
+        assert pool._size == 0
+        assert not pool._idle
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_close_shuts_down_idle_agents_and_discards_released_ones(make_pool):
+    async def run() -> None:
+        pool = make_pool()
+        async with pool.acquire() as busy_agent:
+            async with pool.acquire() as idle_agent:
+                pass
+            await pool.close()
+            assert idle_agent.cody_server.cleaned_up
+            assert not busy_agent.cody_server.cleaned_up
+
+        assert busy_agent.cody_server.cleaned_up
+        assert pool._size == 0
+        assert not pool._idle
+
+    asyncio.run(run())
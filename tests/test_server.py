@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+from codypy.messaging import _BatchingDispatcher
+from codypy.server import CodyServer
+
+
+class _FakeTransport:
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+    def get_write_buffer_limits(self) -> tuple[int, int]:
+        return (0, 0)
+
+    def is_closing(self) -> bool:
+        return False
+
+
+class _RecordingWriter:
+    def __init__(self) -> None:
+        self.transport = _FakeTransport()
+        self.frames: list[bytes] = []
+
+    def write(self, frame: bytes) -> None:
+        self.frames.append(frame)
+
+    def writelines(self, frames: list[bytes]) -> None:
+        self.frames.extend(frames)
+
+    async def drain(self) -> None:
+        pass
+
+
+class _ExitedProcess:
+    returncode = 0
+
+    async def wait(self) -> int:
+        return self.returncode
+
+
+def test_cleanup_writes_held_back_requests_before_shutdown():
+    async def run() -> list[str]:
+        server = CodyServer(cody_binary="", use_tcp=False)
+        server._writer = writer = _RecordingWriter()
+        server._batcher = _BatchingDispatcher(writer, 10.0, 16)
+        server._process = _ExitedProcess()
+        frame = b'Content-Length: 17\r\n\r\n{"method":"exit"}'
+        send = asyncio.create_task(server._batcher.send(frame))
+        await asyncio.sleep(0)
+
+        await server.cleanup_server()
+        await asyncio.wait_for(send, 1.0)
+        return [
+            json.loads(frame.partition(b"\r\n\r\n")[2])["method"]
+            for frame in writer.frames
+        ]
+
+    assert asyncio.run(run()) == ["exit", "shutdown"]